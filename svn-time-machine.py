@@ -16,20 +16,93 @@ import sys
 import svn
 import argparse
 import tempfile
-import urllib
+import urllib.parse
 import os
+import functools
+import threading
+import concurrent.futures
+import collections
+import io
+
+# Quotes a path component for an url (the same names are found many times while walking externals)
+quotePath=functools.lru_cache(maxsize=1024)(urllib.parse.quote)
+
+# Maximum number of externals checked out at the same time
+checkoutJobs=4
+outputLock=threading.Lock()
+
+# Writes to stdout, making sure that output of parallel checkouts is not interleaved
+# Multi-line blocks are built in an io.StringIO and written with a single call, so that they always come out together
+def writeOutput(text):
+  with outputLock:
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+# Splits a list of ExternalFullInfo in groups that can be checked out in parallel
+# Entries whose paths are one inside the other end up in the same group (in the order they must be checked out)
+def groupOverlapping(entries):
+  groups=[]
+  for e in sorted(entries, key=lambda e: os.path.normpath(e.fullPath).split(os.sep)):
+    path=os.path.normpath(e.fullPath).split(os.sep)
+    if groups and path[:len(groups[-1][0])]==groups[-1][0]:
+      groups[-1][1].append(e)
+    else:
+      groups.append((path, [e]))
+  return [group for (path, group) in groups]
 
 # Helper function for checking out an external at a particular revision
 # The passed path MUST contain an external that was already updated.
+# Returns the list of externals (ExternalFullInfo) contained in the external that must be checked out in turn
 def checkoutTimeMachineExternal(entry: svn.ExternalFullInfo, rootRepository: str, internalRevision: str, externalDate: str):
-  sys.stdout.write(f"  External: {entry.url}@{entry.revision}\n")
+  writeOutput(f"  External: {entry.url}@{entry.revision}\n")
   svn.checkout(entry.fullPath, entry.fullUrl, revision=entry.revision, ignoreExternal=True)
   externals=svn.getExternals(entry.fullPath)
+  ret=[]
+  convert=svn.mapExternalBefore(rootRepository, internalRevision, externalDate, externals.listFull())
   for d in externals.listDirs():
-    newVersions=d.map(svn.mapExternalBefore(rootRepository, internalRevision, externalDate))
+    newVersions=d.map(convert)
     svn.setExternals(newVersions)
-    for e in newVersions.listFull():
-      checkoutTimeMachineExternal(e, rootRepository, internalRevision, externalDate)
+    ret.extend(newVersions.listFull())
+  return ret
+
+# Checks out all the given externals (and the externals inside them)
+# Externals waiting to be checked out are kept in a queue: workers add to it the externals they find, and all the queued externals are scheduled together
+# Externals that do not overlap are checked out in parallel using up to checkoutJobs threads
+def checkoutTimeMachineExternals(entries, rootRepository: str, internalRevision: str, externalDate: str):
+  pending=collections.deque(entries)
+  condition=threading.Condition()
+  running=0
+  failed=False
+  # Checks out a group of externals one after the other
+  def checkoutGroup(group):
+    nonlocal running, failed
+    try:
+      for e in group:
+        found=checkoutTimeMachineExternal(e, rootRepository, internalRevision, externalDate)
+        with condition:
+          pending.extend(found)
+          condition.notify()
+    except:
+      failed=True
+      raise
+    finally:
+      with condition:
+        running-=1
+        condition.notify()
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, checkoutJobs)) as executor:
+    futures=[]
+    with condition:
+      while (pending and not failed) or running:
+        if pending and not failed:
+          for group in groupOverlapping(pending):
+            running+=1
+            futures.append(executor.submit(checkoutGroup, group))
+          pending.clear()
+        else:
+          condition.wait()
+  # Reports the first error (if any)
+  for f in futures:
+    f.result()
 
 # Checkout url to path with a revision <= maxRevision
 # maxRevision may be either an integer or a SVN date/time {2024-07-11}
@@ -43,18 +116,20 @@ def checkoutTimeMachineExternal(entry: svn.ExternalFullInfo, rootRepository: str
 # - If useRootRevisionAsMax is False and maxRevision is a date/time:
 #   All externals: The timestamp of maxRevision
 # If recurse is true the process will be replied also for all externals of the project, otherwise it will stop at first level of externals (used to create a shallow tag)
-def checkoutTimeMachine(url, path, maxRevision, *, action, useRootRevisionAsMax=True, recurse=True):
+# depth limits the checkout of url as svn --depth does (externals found in the fetched part are checked out completely)
+def checkoutTimeMachine(url, path, maxRevision, *, action, useRootRevisionAsMax=True, recurse=True, depth=None):
   repository=svn.getRepositoryRoot(url)
   commitData=svn.getCommit(repository, maxRevision)
   rootCommitData=svn.getCommitBefore(url, maxRevision)
+  output=io.StringIO()
   if useRootRevisionAsMax:
     internalRevision=rootCommitData.revision
     externalDate=rootCommitData.date
   else:
     if commitData.revision!=rootCommitData.revision:
-      sys.stdout.write(f"WARNING!\n")
-      sys.stdout.write(f"  Checkout '{url}' has revision {rootCommitData.revision}.\n")
-      sys.stdout.write(f"  Checkout of externals may have a revision up to {commitData.revision}.\n")
+      output.write(f"WARNING!\n")
+      output.write(f"  Checkout '{url}' has revision {rootCommitData.revision}.\n")
+      output.write(f"  Checkout of externals may have a revision up to {commitData.revision}.\n")
     if maxRevision.startswith("{"):
       internalRevision=commitData.revision
       externalDate=maxRevision[1:-1]
@@ -62,22 +137,25 @@ def checkoutTimeMachine(url, path, maxRevision, *, action, useRootRevisionAsMax=
       internalRevision=commitData.revision
       externalDate=commitData.date
   printedCommit=rootCommitData if useRootRevisionAsMax else commitData
-  sys.stdout.write(f"+-%s--+\n"%("-"*max(40,len(url)),))
-  sys.stdout.write(f"| TIME MACHINE {action} OF:\n")
-  sys.stdout.write(f"|  {url}\n")
-  sys.stdout.write(f"+-%s--+\n"%("-"*max(40,len(url)),))
-  sys.stdout.write(f"  COMMIT: {printedCommit.revision} [{svn.localTimeString(printedCommit.date)}]\n")
-  sys.stdout.write(f"  AUTHOR: {printedCommit.author}\n")
-  sys.stdout.write(f"  MESSAGE:\n")
-  sys.stdout.write("    "+commitData.message.replace("\n","\n    ")+"\n")
-  svn.checkout(path, url, revision=internalRevision, ignoreExternal=True)
+  output.write(f"+-%s--+\n"%("-"*max(40,len(url)),))
+  output.write(f"| TIME MACHINE {action} OF:\n")
+  output.write(f"|  {url}\n")
+  output.write(f"+-%s--+\n"%("-"*max(40,len(url)),))
+  output.write(f"  COMMIT: {printedCommit.revision} [{svn.localTimeString(printedCommit.date)}]\n")
+  output.write(f"  AUTHOR: {printedCommit.author}\n")
+  output.write(f"  MESSAGE:\n")
+  output.write("    "+commitData.message.replace("\n","\n    ")+"\n")
+  writeOutput(output.getvalue())
+  svn.checkout(path, url, revision=internalRevision, ignoreExternal=True, depth=depth)
   externals=svn.getExternals(path)
+  entries=[]
+  convert=svn.mapExternalBefore(repository, internalRevision, externalDate, externals.listFull())
   for d in externals.listDirs():
-    newVersions=d.map(svn.mapExternalBefore(repository, internalRevision, externalDate))
+    newVersions=d.map(convert)
     svn.setExternals(newVersions)
-    if recurse:
-      for e in newVersions.listFull():
-        checkoutTimeMachineExternal(e, repository, internalRevision, externalDate)
+    entries.extend(newVersions.listFull())
+  if recurse:
+    checkoutTimeMachineExternals(entries, repository, internalRevision, externalDate)
 
 # Deep tag of url to another url path with a revision <= maxRevision
 # See checkoutTimeMachine for a description of parameters
@@ -85,7 +163,9 @@ def tagTimeMachine(source, destination, maxRevision, *, message=None, useRootRev
   #temporaryDir=os.path.normpath(os.path.abspath("temp"))
   with tempfile.TemporaryDirectory() as temporaryDir:
   #if True:
-    copies=[]
+    # Urls read from svn are canonical: source and destination must be too, as they are compared with them
+    source=svn.canonicalUrl(source)
+    destination=svn.canonicalUrl(destination)
     repository=svn.getRepositoryRoot(source)
     if not destination.startswith(repository+"/"):
       sys.stderr.write("ERROR! Destination '{destination}' must be in same repository as source '{source}'")
@@ -97,9 +177,11 @@ def tagTimeMachine(source, destination, maxRevision, *, message=None, useRootRev
       externalDate=rootCommitData.date
     else:
       if commitData.revision!=rootCommitData.revision:
-        sys.stdout.write(f"WARNING!\n")
-        sys.stdout.write(f"  Checkout '{source}' has revision {rootCommitData.revision}.\n")
-        sys.stdout.write(f"  Checkout of externals may have a revision up to {commitData.revision}.\n")
+        output=io.StringIO()
+        output.write(f"WARNING!\n")
+        output.write(f"  Checkout '{source}' has revision {rootCommitData.revision}.\n")
+        output.write(f"  Checkout of externals may have a revision up to {commitData.revision}.\n")
+        writeOutput(output.getvalue())
       if maxRevision.startswith("{"):
         internalRevision=commitData.revision
         externalDate=maxRevision[1:-1]
@@ -108,106 +190,114 @@ def tagTimeMachine(source, destination, maxRevision, *, message=None, useRootRev
         externalDate=commitData.date
     if message is None:
       message=f"Tag of revision {maxRevision}"
-    curTemp=0
+    # All the changes are collected in a single transaction, so that the whole tag is a single commit
+    transaction=svn.RemoteTransaction(temporaryDir)
+    messageList=[message]
     def newTemporaryDir():
-      nonlocal curTemp
-      while True:
-        try:
-          ret=os.path.join(temporaryDir, f"{curTemp}")
-          curTemp=curTemp+1
-          os.mkdir(ret)
-          return ret
-        except FileExistsError:
-          pass
+      return tempfile.mkdtemp(dir=temporaryDir)
     def isInternalUrl(url):
       return url.startswith(repository+"/")
+    # Returns the url inside the tag of url, where url is sourceUrl or one of its descendants and sourceUrl is tagged to destUrl
+    def tagUrl(url: str, sourceUrl: str, destUrl: str):
+      if url==sourceUrl:
+        return destUrl
+      return destUrl.rstrip("/")+"/"+svn.getRelativePath(sourceUrl, url)
     
     # Function to filter out complex externals (the ones that have external themselves)
-    # dest is the root of the directory we are handling
-    # messageList is a list of messages that will be used for the commit
-    def filterOutComplex(dest: str, messageList: str):
+    # destDir is the url inside the tag of the directory we are handling
+    def filterOutComplex(destDir: str):
       def ret(e: svn.ExternalFullInfo):
         # Also converts relative urls to full urls if we are referring to something outside repository
         if svn.getExternals(e.fullUrl, revision=e.revision):
-          deltaPath=[]
-          base=e.fullPath
-          while base!=dest:
-            base, name=os.path.split(base)
-            deltaPath.insert(0,name)
-          destUrl=destination
-          for n in deltaPath:
-            if not destUrl.endswith("/"):
-              destUrl=destUrl+"/"
-            destUrl=destUrl+urllib.parse.quote(n)
+          destUrl=destDir.rstrip("/")+"/"+quotePath(e.name)
           if isInternalUrl(e.fullUrl):
             nextSteps.append((e.fullUrl, e.url, destUrl))
           else:
-            handleExternalCheckout(e, dest, messageList)
+            handleExternalCheckout(e, destUrl)
         else:
           url=e.url if isInternalUrl(e.fullUrl) else e.fullUrl
           return svn.ExternalInfo(e.name, url, e.revision)
       return ret
-    # d is a DirWithExternal that must be handled
-    def handleDirWithExternals(d, dest, messageList):
-      newVersions=d.map(svn.mapExternalBefore(repository, internalRevision, externalDate))
-      newVersions=newVersions.map(filterOutComplex(dest, messageList))
-      svn.setExternals(newVersions)
+    # externals is an ExternalTree that must be handled, contained in sourceUrl that is tagged to destUrl
+    def handleExternals(externals, sourceUrl, destUrl):
+      # Revisions of all the externals of the tree are resolved together
+      convert=svn.mapExternalBefore(repository, internalRevision, externalDate, externals.listFull())
+      dirs=[d.map(convert) for d in externals.listDirs()]
+      # filterOutComplex reads the externals of each external: they are all read at the same time
+      svn.prefetchExternals((e.fullUrl, e.revision) for d in dirs for e in d.listFull())
+      for newVersions in dirs:
+        destDir=tagUrl(newVersions.basePath, sourceUrl, destUrl)
+        newVersions=newVersions.map(filterOutComplex(destDir))
+        transaction.setExternals(destDir, newVersions)
       
-    def handleExternalCheckout(entry, dest, messageList):
+    # Imports the content of entry (an external from another repository) inside the tag at destUrl
+    def handleExternalCheckout(entry, destUrl):
       if not enableImports:
-        sys.stdout.write(f"\n\nERROR!\nContent of external '{entry.fullUrl}' must be copied inside tag to perform the tag.\nUse --enable-imports to allow it or make a shallow copy.\n")
+        writeOutput(f"\n\nERROR!\nContent of external '{entry.fullUrl}' must be copied inside tag to perform the tag.\nUse --enable-imports to allow it or make a shallow copy.\n")
         sys.exit(0)
         
-      def getLocalPath(url):
-        relativePath=svn.getRelativePath(entry.fullUrl, url).split("/")
-        return os.path.join(entry.fullPath, *map(lambda x: urllib.parse.unquote(x), relativePath))
       messageList.append(f"- Import of {entry.fullUrl}@{entry.revision}")
-      sys.stdout.write(f"  IMPORT: {entry.fullUrl}@{entry.revision}\n")
-      sys.stdout.write(f"    INTO: {entry.fullPath}\n")
-      svn.export(entry.fullPath, entry.fullUrl, revision=entry.revision, ignoreExternal=True)
-      svn.add(entry.fullPath)
+      writeOutput(f"  IMPORT: {entry.fullUrl}@{entry.revision}\n    INTO: {destUrl}\n")
+      exportPath=os.path.join(newTemporaryDir(), "export")
+      svn.export(exportPath, entry.fullUrl, revision=entry.revision, ignoreExternal=True)
+      if os.path.isdir(exportPath) and not os.path.islink(exportPath):
+        # Url of each exported directory (os.walk gives parents before their children)
+        dirUrls={exportPath: destUrl}
+        for (base, dirs, files) in os.walk(exportPath):
+          baseUrl=dirUrls[base]
+          transaction.mkdir(baseUrl)
+          for d in dirs:
+            if os.path.islink(os.path.join(base, d)):
+              # Links to directories are not walked by os.walk: they are uploaded as links
+              importFile(os.path.join(base, d), f"{baseUrl}/{quotePath(d)}")
+            else:
+              dirUrls[os.path.join(base, d)]=f"{baseUrl}/{quotePath(d)}"
+          for f in files:
+            importFile(os.path.join(base, f), f"{baseUrl}/{quotePath(f)}")
+      else:
+        importFile(exportPath, destUrl)
       
-      for d in svn.getExternals(entry.fullUrl, revision=entry.revision).listDirs():
-        newDir=svn.DirWithExternals(getLocalPath(d.basePath), d.repository)
-        for e in d.listFull():
-          newDir.add(e.name, e.url, e.revision)
-        handleDirWithExternals(newDir, dest, messageList)
+      handleExternals(svn.getExternals(entry.fullUrl, revision=entry.revision), entry.fullUrl, destUrl)
+    # Uploads an exported file to url, keeping the properties svn add would set (links as svn:special, svn:executable)
+    def importFile(path, url):
+      if os.path.islink(path):
+        transaction.link(os.readlink(path), url)
+      else:
+        transaction.put(path, url)
+        if os.name!="nt" and os.access(path, os.X_OK):
+          transaction.propset('svn:executable', '*', url)
     def handleInternalCheckout(url: str, showedUrl: str|None, destUrl: str):
-      messageList=[message if showedUrl is None else message+f"\n- Tag of external {destUrl}"]
-      dest=newTemporaryDir()
+      if showedUrl is not None:
+        messageList.append(f"- Tag of external {destUrl}")
       isInternal=isInternalUrl(url)
       curRevision=svn.getCommitBefore(url, internalRevision if isInternal else "{%s}"%(externalDate,))
+      output=io.StringIO()
       if showedUrl is not None:
-        sys.stdout.write(f"  EXTERNAL: {showedUrl}@{curRevision.revision}\n")
-        sys.stdout.write(f"    DESTINATION: {destUrl}\n")
+        output.write(f"  EXTERNAL: {showedUrl}@{curRevision.revision}\n")
+        output.write(f"    DESTINATION: {destUrl}\n")
       else:
-        sys.stdout.write(f"+-%s--+\n"%("-"*max(40,len(url)),))
-        sys.stdout.write(f"| TIME MACHINE TAG OF:\n")
-        sys.stdout.write(f"|  {url}\n")
-        sys.stdout.write(f"+-%s--+\n"%("-"*max(40,len(url)),))
-        sys.stdout.write(f"  COMMIT: {curRevision.revision} [{svn.localTimeString(curRevision.date)}]\n")
-        sys.stdout.write(f"  AUTHOR: {curRevision.author}\n")
-        sys.stdout.write(f"  MESSAGE:\n")
-        sys.stdout.write("    "+curRevision.message.replace("\n","\n    ")+"\n")
-        sys.stdout.write(f"  DESTINATION: {destUrl}\n")
+        output.write(f"+-%s--+\n"%("-"*max(40,len(url)),))
+        output.write(f"| TIME MACHINE TAG OF:\n")
+        output.write(f"|  {url}\n")
+        output.write(f"+-%s--+\n"%("-"*max(40,len(url)),))
+        output.write(f"  COMMIT: {curRevision.revision} [{svn.localTimeString(curRevision.date)}]\n")
+        output.write(f"  AUTHOR: {curRevision.author}\n")
+        output.write(f"  MESSAGE:\n")
+        output.write("    "+curRevision.message.replace("\n","\n    ")+"\n")
+        output.write(f"  DESTINATION: {destUrl}\n")
+      writeOutput(output.getvalue())
   
-      svn.checkout(dest, url, revision=internalRevision if isInternal else "{%s}"%(externalDate,), ignoreExternal=True)
-      externals=svn.getExternals(dest)
-      for d in externals.listDirs():
-        handleDirWithExternals(d, dest, messageList)
-      #curMessage=
-      curMessage='\n'.join(messageList)
-      #print(f"Copy {dest}->{destUrl}\n'{curMessage}'")
-      copies.append((dest, destUrl, curMessage))
+      # Server side copy: the externals are then changed directly on the copied urls
+      transaction.copy(url, destUrl, revision=curRevision.revision)
+      # Internal externals are pinned to internalRevision by mapExternalBefore: reading at the same revision reuses the cached result of the check done by filterOutComplex
+      handleExternals(svn.getExternals(url, revision=internalRevision if isInternal else curRevision.revision), url, destUrl)
     # url, showed url, destination url
     nextSteps=[(source, None, destination)]
     while nextSteps:
       (url, showedUrl, destUrl)=nextSteps.pop()
       handleInternalCheckout(url, showedUrl, destUrl)
-    sys.stdout.write(f"  PERFORMING COPY\n")
-    for (dest, destUrl, curMessage) in copies:
-      print(dest, destUrl, repr(message))
-      svn.copy(dest, destUrl, message=curMessage)
+    writeOutput(f"  PERFORMING COPY\n")
+    transaction.commit(message='\n'.join(messageList))
 
 parser = argparse.ArgumentParser(
                     prog=os.path.basename(sys.argv[0]),
@@ -218,11 +308,14 @@ parser = argparse.ArgumentParser(
 parser.add_argument('url', help="The url to checkout/tag")
 parser.add_argument('revision', help="The time instant to checkout/tag. Can be an integer revision number (e.g. 437) or a date/time as defined by SVN (e.g. {2006-02-17}, {2006-02-17T15:30}, ...). If an integer revision is given the externals fetched will be the ones at the date/time of that commit, otherwise the ones at the date/time specified.")
 parser.add_argument('--debug', default=False, action=argparse.BooleanOptionalAction, help="Prints the operations and commands performed")
+parser.add_argument('--interactive', default=True, action=argparse.BooleanOptionalAction, help="If false svn will never prompt for credentials or certificates (useful for unattended runs).")
 subparsers = parser.add_subparsers(dest='command')
 # Checkout
 parserCheckout=subparsers.add_parser('checkout', help="Checkout of a repository with time machine.")
 parserCheckout.add_argument('path', help="The destination for the checkout")
 parserCheckout.add_argument('--use-root-revision', default=False, action=argparse.BooleanOptionalAction, help="If true all the externals will be with commit revisions/timestamps less or equal to the commit revision/timestamps of the root checkout directory (the one speciied with url). Otherwise the reference revision will be the one specified with revision parameter.")
+parserCheckout.add_argument('--depth', default=None, choices=['empty', 'files', 'immediates', 'infinity'], help="Depth of the checkout of url (as svn --depth). Externals inside the checked out part are checked out completely.")
+parserCheckout.add_argument('-j', '--jobs', type=int, default=checkoutJobs, help="Maximum number of externals that are checked out at the same time.")
 # Tag
 parserDeepTag=subparsers.add_parser('tag', help="Tag of a time-machined repository. In case the externals contains more externals the operation will be split in multiple steps to ensure that even the sub-externals version is forced. In case the externals refers to another repository this may also mean that files from other repository will be actually imported inside the tag.")
 parserDeepTag.add_argument('destination', help="The url destination for the tag")
@@ -238,11 +331,14 @@ parserShallowTag.add_argument('-r', '--use-root-revision', default=False, action
 args = parser.parse_args()
 if args.debug:
   svn.enableDebug=True
+if not args.interactive:
+  svn.globalOptions.append('--non-interactive')
 if args.command=='tag':
   tagTimeMachine(args.url, args.destination, args.revision, useRootRevisionAsMax=args.use_root_revision, message=args.message, enableImports=args.enable_imports)
   #checkoutTimeMachine(args.url, temporaryDir, args.revision, useRootRevisionAsMax=args.use_root_revision, action="DEEP TAG")
 elif args.command=='checkout':
-  checkoutTimeMachine(args.url, args.path, args.revision, useRootRevisionAsMax=args.use_root_revision, action="CHECKOUT")
+  checkoutJobs=args.jobs
+  checkoutTimeMachine(args.url, args.path, args.revision, useRootRevisionAsMax=args.use_root_revision, action="CHECKOUT", depth=args.depth)
 else:
   sys.write("Unsupported mode!\n")
   sys.exit(0)
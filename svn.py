@@ -15,39 +15,105 @@
 
 import subprocess
 from dataclasses import field, dataclass, InitVar
-import xml.etree.ElementTree as ET
+try:
+  # lxml is faster, but is not mandatory
+  from lxml import etree as ET
+except ImportError:
+  import xml.etree.ElementTree as ET
 import os.path
 import urllib.parse
 import re
 import datetime
 import time
 import sys
+import tempfile
+import functools
+import contextlib
+import threading
+import asyncio
+import io
+try:
+  # subvertpy allows to keep a connection to each repository open between queries, but is not mandatory
+  from subvertpy import ra as svnRa
+  from subvertpy import SubversionException
+except ImportError:
+  svnRa=None
 
 enableDebug=False
-def executeSvn(*commandLine):
+# Options added to every svn command (e.g. --non-interactive)
+globalOptions=[]
+def svnCommandLine(commandLine, program="svn"):
   if enableDebug:
-    sys.stderr.write("*** RUNNING SVN COMMAND: %s\n\n"%(" ".join(commandLine),))
-  cmdLine=["svn"]
+    sys.stderr.write("*** RUNNING %s COMMAND: %s\n\n"%(program.upper(), " ".join(commandLine)))
+  cmdLine=[program]
+  cmdLine.extend(globalOptions)
   cmdLine.extend(commandLine)
-  result=subprocess.run(cmdLine, stdout=subprocess.PIPE)
+  return cmdLine
+
+# Runs svn and returns its whole output (for commands with a small output)
+def executeSvn(*commandLine):
+  result=subprocess.run(svnCommandLine(commandLine), stdout=subprocess.PIPE)
   if result.returncode!=0:
     raise SvnException("FAILED TO RUN SVN '%s'"%(" ".join(commandLine)))
   return result.stdout
 
+# Runs svnmucc (svn multiple url command client)
+def executeSvnmucc(*commandLine):
+  result=subprocess.run(svnCommandLine(commandLine, "svnmucc"), stdout=subprocess.PIPE)
+  if result.returncode!=0:
+    raise SvnException("FAILED TO RUN SVNMUCC '%s'"%(" ".join(commandLine)))
+  return result.stdout
+
+# Runs svn giving access to its output as a file object while svn is still running, so that large outputs can be parsed without keeping them in memory
+# Must be used in a with statement and the output must be read until its end
+@contextlib.contextmanager
+def executeSvnStream(*commandLine):
+  process=subprocess.Popen(svnCommandLine(commandLine), stdout=subprocess.PIPE)
+  try:
+    yield process.stdout
+  except ET.ParseError as e:
+    # An incomplete xml is usually caused by svn failing
+    process.stdout.close()
+    if process.wait()!=0:
+      raise SvnException("FAILED TO RUN SVN '%s'"%(" ".join(commandLine))) from e
+    raise
+  finally:
+    process.stdout.close()
+    returncode=process.wait()
+  if returncode!=0:
+    raise SvnException("FAILED TO RUN SVN '%s'"%(" ".join(commandLine)))
+
+# Iterates on the xml elements named tag read from stream, clearing each element once handled
+def iterXml(stream, tag):
+  for (event, element) in ET.iterparse(stream, events=("end",)):
+    if element.tag==tag:
+      yield element
+      element.clear()
+      if hasattr(element, "getprevious"):
+        # lxml keeps cleared elements attached to their parent: drop them
+        while element.getprevious() is not None:
+          del element.getparent()[0]
+
 class SvnException(Exception):
     pass
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class CommitInfo:
   revision: int
   date: str
   author: str
   message: str
 
+# Url schemes supported by svn
+urlPrefixes=("http://", "https://", "svn://", "svn+ssh://", "file://")
 def isUrl(path):
-  return path.startswith("http://")
+  return path.startswith(urlPrefixes)
 
-@dataclass(frozen=True)
+# Converts an url given by the user to the canonical form used by svn in its output (no trailing slash, special characters percent-encoded)
+def canonicalUrl(url):
+  return urllib.parse.quote(url.rstrip("/"), safe=":/@%!$&'()*+,;=~")
+
+@dataclass(frozen=True, slots=True)
 class ExternalInfo:
   name: str
   url: str
@@ -57,7 +123,7 @@ class ExternalInfo:
     return self.url.startswith("^/")
 
 # External info, including its repository
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class ExternalFullInfo(ExternalInfo):
   baseDir: str
   repository: str
@@ -73,6 +139,7 @@ class ExternalFullInfo(ExternalInfo):
 
 # Join an url with a repository.
 # If url starts with ^ it will be joined to repository, otherwise it will be the returned url
+@functools.lru_cache(maxsize=4096)
 def repositoryJoin(repository, url):
   if url.startswith("^/"):
     url=url[2:]
@@ -101,8 +168,11 @@ class DirWithExternals:
     self.__basePath=basePath
     self.__repository=repository
     self.__data={}
+    self.__entries=None
   # Returns an iterator to elements as ExternalInfo structures
   def __iter__(self):
+    if self.__entries is not None:
+      return iter(self.__entries)
     return iter(self.__data.values())
   def __bool__(self):
     return len(self.__data)!=0
@@ -118,7 +188,14 @@ class DirWithExternals:
       yield ExternalFullInfo(e.name, e.url, e.revision, self.__basePath, self.__repository)
   # Adds an entry
   def add(self, name: str, url: str, revision: str|None=None):
+    if self.__entries is not None:
+      raise SvnException(f"Cannot add {name} to the already frozen externals of {self.__basePath}")
     self.__data[name]=ExternalInfo(name, url, revision)
+  # Marks the list of entries as complete (no more entries can be added), keeping them in a tuple for faster iteration
+  def freeze(self):
+    if self.__entries is None:
+      self.__entries=tuple(self.__data.values())
+    return self
   # Returns another DirWithExternals with elements created by calling convert(ExternalFullInfo)->ExternalFullInfo|ExternalInfo|None
   def map(self, conversionFunction):
     ret=DirWithExternals(self.basePath, self.repository)
@@ -127,17 +204,26 @@ class DirWithExternals:
       if val is not None:
         assert(isinstance(val, (ExternalInfo, ExternalFullInfo)))
         ret.add(val.name, val.url, val.revision)
-    return ret
+    return ret.freeze()
 
 class ExternalTree:
   def __init__(self, localPath: str):
     self.__localPath=localPath
     self.__data={}
+    self.__frozen=False
   def __iter__(self):
     return iter(self.__data.items())
   def __bool__(self):
     return bool(self.__data)
+  # Marks the tree as complete: no more entries can be added, so that it can be safely shared
+  def freeze(self):
+    for d in self.__data.values():
+      d.freeze()
+    self.__frozen=True
+    return self
   def add(self, localPath: str, url: str, repository: str, commit: str|None=None):
+    if self.__frozen:
+      raise SvnException(f"Cannot add {localPath} to the already frozen externals of {self.__localPath}")
     if isUrl(self.__localPath):
       localPath=repositoryJoin(self.__localPath, localPath)
       if not localPath.startswith(self.__localPath+"/"):
@@ -153,69 +239,260 @@ class ExternalTree:
     return iter(self.__data.values())
   # Returns an iterator of ExternalFullInfo with all the elements
   def listFull(self):
-    ret=[]
     for (base, dirObject) in self:
       for entry in dirObject.listFull():
         yield entry
   #def externalBaseDirs(self):
 
     
+# Maximum number of svn commands run at the same time by the asynchronous queries
+asyncConcurrency=8
+
+# Asynchronous version of executeSvn, used to run many small queries at the same time
+# semaphore (an asyncio.Semaphore) limits the number of svn processes running together
+async def executeSvnAsync(semaphore, *commandLine):
+  async with semaphore:
+    process=await asyncio.create_subprocess_exec(*svnCommandLine(commandLine), stdout=asyncio.subprocess.PIPE)
+    stdout, stderr=await process.communicate()
+  if process.returncode!=0:
+    raise SvnException("FAILED TO RUN SVN '%s'"%(" ".join(commandLine)))
+  return stdout
+
+# Remote access sessions (only when subvertpy is available): repository root -> (session, lock)
+remoteSessions={}
+remoteSessionsLock=threading.Lock()
+
+# Returns true if the query of url at reference can be done using a remote access session
+def canUseRemoteSession(url, reference):
+  return svnRa is not None and isUrl(url) and (isNumericRevision(reference) or reference=="HEAD")
+
+def isNumericRevision(reference):
+  return isinstance(reference, int) or (isinstance(reference, str) and reference.isdigit())
+
+# Calls function(session) with a subvertpy session pointing to url
+# Sessions are opened once per repository (so that connection and authentication are done only once) and used by a thread at a time
+def withRemoteSession(url, function):
+  with remoteSessionsLock:
+    for (root, (session, lock)) in remoteSessions.items():
+      if url==root or url.startswith(root+"/"):
+        break
+    else:
+      if enableDebug:
+        sys.stderr.write(f"*** OPENING REMOTE SESSION: {url}\n\n")
+      auth=svnRa.Auth([svnRa.get_simple_provider(), svnRa.get_username_provider(), svnRa.get_ssl_server_trust_file_provider(), svnRa.get_ssl_client_cert_file_provider(), svnRa.get_ssl_client_cert_pw_file_provider()])
+      session=svnRa.RemoteAccess(url, auth=auth)
+      lock=threading.Lock()
+      root=session.get_repos_root()
+      remoteSessions[root]=(session, lock)
+      repositoryRoots.add(root)
+  with lock:
+    session.reparent(url)
+    return function(session)
+
+# Get with a remote session the newest commit of url with a revision between start and end (numeric revisions or HEAD)
+def getRemoteCommit(url: str, start, end)->CommitInfo:
+  def query(session):
+    def revisionNumber(reference):
+      return session.get_latest_revnum() if reference=="HEAD" else int(reference)
+    ret=[]
+    def logEntry(changedPaths, revision, revprops, hasChildren=False):
+      def revprop(name):
+        value=revprops.get(name)
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+      ret.append(CommitInfo(revision=revision, author=revprop("svn:author"), date=revprop("svn:date"), message=revprop("svn:log")))
+    if enableDebug:
+      sys.stderr.write(f"*** REMOTE LOG: {url} {start}:{end}\n\n")
+    session.get_log(logEntry, [""], revisionNumber(start), revisionNumber(end), 1, discover_changed_paths=False, strict_node_history=False)
+    if not ret:
+      raise SvnException("COULD NOT FIND COMMIT IN REMOTE LOG")
+    return ret[0]
+  return withRemoteSession(url, query)
+
+# Reads the first commit of a svn log xml
+def readCommit(stream)->CommitInfo:
+  ret=None
+  for entry in iterXml(stream, 'logentry'):
+    if ret is None:
+      ret=CommitInfo(revision=int(entry.attrib.get('revision')), author=entry.findtext('author'), date=entry.findtext('date'), message=entry.findtext('msg'))
+  if ret is None:
+    raise SvnException("COULD NOT FIND COMMIT IN SVT XML")
+  return ret
+
 # Get information about the commit happened at a time <=reference
+@functools.lru_cache(maxsize=None)
 def getCommitBefore(url: str, reference: str)->CommitInfo:
+  if canUseRemoteSession(url, reference):
+    try:
+      return getRemoteCommit(url, reference, 0)
+    except SubversionException:
+      # Falls back to svn command line
+      pass
+  with executeSvnStream(*commitBeforeCommandLine(url, reference)) as result:
+    return readCommit(result)
+
+def commitBeforeCommandLine(url: str, reference: str):
   try:
     # Tries to inject the version inside the url (so that we can handle cases were there was a directory change)
     url=f"{url}@{int(reference)}"
   except:
     pass
-  cmdLine=['log', url, '--xml', '-r', f'{reference}:0', '-l', '1']
-  result=executeSvn(*cmdLine)
-  entry = ET.fromstring(result).find('logentry')
-  if entry is None:
-    raise SvnException("COULD NOT FIND COMMIT IN SVT XML")
-  return CommitInfo(revision=int(entry.attrib.get('revision')), author=entry.findtext('author'), date=entry.findtext('date'), message=entry.findtext('msg'))
+  return ['log', url, '--xml', '-r', f'{reference}:0', '-l', '1']
+
+# Get information about the commits happened at a time <=reference for many (url, reference) pairs, running the queries at the same time
+# Returns a dictionary (url, reference) -> CommitInfo with the pairs that could be found (their revisions are also stored in revisionBeforeCache)
+def getCommitsBefore(pairs):
+  pairs=list(dict.fromkeys(pairs))
+  async def queryAll():
+    semaphore=asyncio.Semaphore(asyncConcurrency)
+    return await asyncio.gather(*(executeSvnAsync(semaphore, *commitBeforeCommandLine(url, reference)) for (url, reference) in pairs), return_exceptions=True)
+  results=asyncio.run(queryAll()) if pairs else []
+  # Outputs are parsed once all the queries are completed, so that the event loop is never blocked
+  ret={}
+  for (pair, result) in zip(pairs, results):
+    if isinstance(result, bytes):
+      try:
+        ret[pair]=readCommit(io.BytesIO(result))
+      except (SvnException, ET.ParseError):
+        continue
+      revisionBeforeCache[pair]=ret[pair].revision
+  return ret
 
 # Get information about the commit happened at a time <=reference
+@functools.lru_cache(maxsize=None)
 def getCommit(url: str, reference: str)->CommitInfo:
+  if canUseRemoteSession(url, reference):
+    try:
+      return getRemoteCommit(url, reference, reference)
+    except SubversionException:
+      # Falls back to svn command line
+      pass
   cmdLine=['log', url, '--xml', '-r', f'{reference}', '-l', '1']
-  result=executeSvn(*cmdLine)
-  entry = ET.fromstring(result).find('logentry')
-  if entry is None:
-    raise SvnException("COULD NOT FIND COMMIT IN SVT XML")
-  return CommitInfo(revision=int(entry.attrib.get('revision')), author=entry.findtext('author'), date=entry.findtext('date'), message=entry.findtext('msg'))
+  with executeSvnStream(*cmdLine) as result:
+    return readCommit(result)
+
+# Get the revision of the last commit happened at a time <=reference for many (url, reference) pairs using a single svn command
+# Returns a dictionary (url, reference) -> revision
+# Already known pairs are taken from revisionBeforeCache without querying svn
+revisionBeforeCache={}
+def getRevisionsBefore(pairs):
+  pairs=list(dict.fromkeys(pairs))
+  ret={pair: revisionBeforeCache[pair] for pair in pairs if pair in revisionBeforeCache}
+  pairs=[pair for pair in pairs if pair not in ret]
+  if not pairs:
+    return ret
+  # svn info of url@reference reports the last commit that changed url up to reference
+  with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".txt", delete=False) as targets:
+    for (url, reference) in pairs:
+      targets.write(f"{url}@{reference}\n")
+  try:
+    revisions=[]
+    with executeSvnStream('info', '--xml', '--targets', targets.name) as result:
+      for entry in iterXml(result, 'entry'):
+        revisions.append(int(entry.find('commit').attrib.get('revision')))
+  finally:
+    os.remove(targets.name)
+  if len(revisions)!=len(pairs):
+    raise SvnException("UNEXPECTED NUMBER OF ENTRIES IN SVN XML")
+  for (pair, revision) in zip(pairs, revisions):
+    ret[pair]=revisionBeforeCache[pair]=revision
+  return ret
 
+# Matches an external url with an explicit revision (url@revision)
+explicitRevisionRegex=re.compile(r"^(.+)@(\d+)$")
+
+# Results of getExternals on urls at a given revision, as they will not change
+externalsCache={}
 # Returns a dictionary with external dependencies
 #   baseDir: [(name, url)]
+# The returned ExternalTree is frozen (it may be shared with other callers)
 def getExternals(path, *, recursive=True, revision=None):
+  cacheKey=externalsCacheKey(path, recursive, revision)
+  if cacheKey in externalsCache:
+    return externalsCache[cacheKey]
+  with executeSvnStream(*externalsCommandLine(path, recursive, revision)) as result:
+    ret=readExternals(path, result)
+  if cacheKey is not None:
+    externalsCache[cacheKey]=ret
+  return ret
+
+# Reads the externals of many (url, revision) pairs running the queries at the same time, so that following calls to getExternals will find them in cache
+# Errors are ignored here (they will be reported by getExternals)
+def prefetchExternals(targets):
+  def isMissing(url, revision):
+    cacheKey=externalsCacheKey(url, True, revision)
+    return cacheKey is not None and cacheKey not in externalsCache
+  targets=[(url, revision) for (url, revision) in dict.fromkeys(targets) if isMissing(url, revision)]
+  if len(targets)<2:
+    return
+  async def queryAll():
+    semaphore=asyncio.Semaphore(asyncConcurrency)
+    return await asyncio.gather(*(executeSvnAsync(semaphore, *externalsCommandLine(url, True, revision)) for (url, revision) in targets), return_exceptions=True)
+  results=asyncio.run(queryAll())
+  # Outputs are parsed once all the queries are completed: readExternals may run svn itself (getRepositoryRoot) and would block the event loop
+  for ((url, revision), result) in zip(targets, results):
+    if isinstance(result, bytes):
+      try:
+        externalsCache[externalsCacheKey(url, True, revision)]=readExternals(url, io.BytesIO(result))
+      except (SvnException, ET.ParseError):
+        pass
+
+# Key of externalsCache for a getExternals query, None if the result may change and must not be cached
+# Only urls read at a revision number or at an explicit {date} are cached (HEAD, BASE, ... may change)
+def externalsCacheKey(path, recursive, revision):
+  if not isUrl(path) or revision is None:
+    return None
+  revision=str(revision)
+  if not (isNumericRevision(revision) or (revision.startswith("{") and revision.endswith("}"))):
+    return None
+  return (path, recursive, revision)
+
+def externalsCommandLine(path, recursive, revision):
   cmdLine=['propget', 'svn:externals', path, '--xml']
   if recursive:
     cmdLine.append('-R')
   if revision is not None:
     cmdLine.extend(('-r', str(revision)))
-  result=executeSvn(*cmdLine)
+  return cmdLine
+
+# Reads the xml output of svn propget svn:externals run on path
+def readExternals(path, stream):
   ret=ExternalTree(path)
-  for e in ET.fromstring(result).iter("target"):
+  for e in iterXml(stream, "target"):
     base=e.attrib.get("path")
     repository=getRepositoryRoot(base)
     for l in e.findtext("property").split("\n"):
       l=l.strip()
       if not l:
         continue
-      pos=l.find(" ")
-      if pos<0:
+      fields=l.split(None, 1)
+      if len(fields)<2:
         sys.stderr.write(f"INVALID EXTERNAL ENTRY: {l}")
         sys.exit(0)
-      baseName=l[pos+1:]
+      url, baseName=fields
       if baseName.startswith("\"") and baseName.endswith("\""):
         baseName=baseName[1:-1]
-      url=l[:pos]
-      explicitRev=re.match(r"(.*)@(\d+)", url)
+      explicitRev=explicitRevisionRegex.match(url)
       if explicitRev is not None:
         url=explicitRev.group(1)
         revision=explicitRev.group(2)
       else:
         revision=None
       ret.add(pathJoin(base, baseName), url, repository, revision)
-  return ret
+  return ret.freeze()
+
+# Value of the svn:externals property listing the entries of values (a DirWithExternals)
+def externalsValue(values):
+  def generateLine(entry: ExternalInfo):
+    ret=entry.url
+    if entry.revision is not None:
+      ret+=f"@{entry.revision}"
+    ret+=" "
+    if " " in entry.name:
+      ret+=f'"{entry.name}"'
+    else:
+      ret+=entry.name
+    return ret
+  return "\n".join(map(lambda it: generateLine(it),values))
 
 # values must be a DirWithExternals or a ExternalFullInfo
 def setExternals(values):
@@ -223,46 +500,87 @@ def setExternals(values):
     for d in values.listDirs():
       setExternals(d)
   elif isinstance(values, DirWithExternals):
-    def generateLine(entry: ExternalInfo):
-      ret=entry.url
-      if entry.revision is not None:
-        ret+=f"@{entry.revision}"
-      ret+=" "
-      if " " in entry.name:
-        ret+=f'"{entry.name}"'
-      else:
-        ret+=entry.name
-      return ret
-    newExternal="\n".join(map(lambda it: generateLine(it),values))
-    result=executeSvn('propset', 'svn:externals', newExternal, values.basePath)
+    result=executeSvn('propset', 'svn:externals', externalsValue(values), values.basePath)
   else:
     raise SvnError("setExternal expects a DirWithExternals or an ExternalFullInfo")
 
+# Repository roots found so far: urls inside one of them do not need to query svn
+# (local paths always do, as a directory of a working copy may be an external from another repository)
+repositoryRoots=set()
+@functools.lru_cache(maxsize=None)
 def getRepositoryRoot(path):
-  result=executeSvn('info', path, '--xml')
-  return ET.fromstring(result).find('entry').find('repository').findtext("root")
+  if isUrl(path):
+    for root in list(repositoryRoots):
+      if path==root or path.startswith(root+"/"):
+        return root
+    if svnRa is not None:
+      try:
+        return withRemoteSession(path, lambda session: session.get_repos_root())
+      except SubversionException:
+        # Falls back to svn command line
+        pass
+  if svnVersion()>=(1, 9):
+    # Asks directly for the root, without parsing the full xml info
+    root=executeSvn('info', path, '--show-item', 'repos-root-url', '--no-newline').decode("utf-8")
+  else:
+    result=executeSvn('info', path, '--xml')
+    root=ET.fromstring(result).find('entry').find('repository').findtext("root")
+  repositoryRoots.add(root)
+  return root
+
+# Version of the svn command line client (e.g. (1, 14)), (0, 0) if it cannot be detected
+@functools.lru_cache(maxsize=None)
+def svnVersion():
+  try:
+    version=re.match(r"(\d+)\.(\d+)", executeSvn('--version', '--quiet').decode("utf-8"))
+  except SvnException:
+    version=None
+  return (int(version.group(1)), int(version.group(2))) if version is not None else (0, 0)
 
 # Gets a functor that can be passed to DirWithExternals.map()
 # rootRepository must be the url to a repository
 # internalRevision can be a numeric revision or a date/time
 # externalDate must be a date/time string
+# prefetch is an iterable of the ExternalFullInfo that will be converted (e.g. ExternalTree.listFull() when all the directories of a tree are converted): their revisions are fetched all together with a single svn command
 # Given an entry:
 # - If the entry has a fixed revision returned revision will be its revision
 # - If entry repository is same as rootRepository returned revision will be  <= internalRevision
+#   (internalRevision itself if it is numeric: the content is the same of the last commit before it, and no query is needed)
 # - If entry repository is not the same as rootRepository returned revision will be  <= externalDate
-def mapExternalBefore(rootRepository, internalRevision, externalDate):
+def mapExternalBefore(rootRepository, internalRevision, externalDate, prefetch=()):
+  pinInternal=isNumericRevision(internalRevision)
+  def isInternal(entry: ExternalFullInfo):
+    return entry.fullUrl.startswith(rootRepository+"/")
+  def reference(entry: ExternalFullInfo):
+    if isInternal(entry):
+      return internalRevision
+    else:
+      return "{%s}"%(externalDate,)
+  def needsQuery(entry: ExternalFullInfo):
+    return entry.revision is None and not (pinInternal and isInternal(entry))
+  pairs=[(e.fullUrl, reference(e)) for e in prefetch if needsQuery(e)]
+  try:
+    revisions=getRevisionsBefore(pairs)
+  except SvnException:
+    # Falls back to one query per entry (all run at the same time)
+    revisions={pair: revisionBeforeCache[pair] for pair in pairs if pair in revisionBeforeCache}
+    revisions.update((pair, commit.revision) for (pair, commit) in getCommitsBefore(pair for pair in pairs if pair not in revisions).items())
   def ret(entry: ExternalFullInfo)->ExternalInfo:
     if entry.revision is not None:
       return entry
+    elif pinInternal and isInternal(entry):
+      return ExternalInfo(entry.name, entry.url, int(internalRevision))
     else:
-      if entry.fullUrl.startswith(rootRepository+"/"):
-        revision=getCommitBefore(entry.fullUrl, internalRevision).revision
-      else:
-        revision=getCommitBefore(entry.fullUrl, "{%s}"%(externalDate,)).revision
+      entryReference=reference(entry)
+      revision=revisions.get((entry.fullUrl, entryReference))
+      if revision is None:
+        revision=getCommitBefore(entry.fullUrl, entryReference).revision
+        revisionBeforeCache[(entry.fullUrl, entryReference)]=revision
       return ExternalInfo(entry.name, entry.url, revision)
   return ret
 
-def checkout(path, url, *, revision: str|CommitInfo|None=None, ignoreExternal=False):
+# depth (e.g. empty, files, immediates, infinity) limits the part of the tree fetched
+def checkout(path, url, *, revision: str|CommitInfo|None=None, ignoreExternal=False, depth: str|None=None):
   if isinstance(revision, CommitInfo):
     revision=revision.revision
   try:
@@ -276,6 +594,8 @@ def checkout(path, url, *, revision: str|CommitInfo|None=None, ignoreExternal=Fa
     cmdLine.extend(('-r', f'{revision}'))
   if ignoreExternal:
     cmdLine.append('--ignore-externals')
+  if depth is not None:
+    cmdLine.append(f'--depth={depth}')
   result=executeSvn(*cmdLine)
 
 def export(path, url, *, revision: str|CommitInfo|None=None, ignoreExternal=False):
@@ -303,6 +623,49 @@ def update(path):
 def copy(src: str, dst: str, *, message: str):
   executeSvn('copy', src, dst, "-m", message)
 
+# Collects operations on the urls of a repository, then commits all of them as a single revision using svnmucc
+# directory is where the temporary files needed by the operations are kept (the system one if None)
+class RemoteTransaction:
+  def __init__(self, directory: str|None=None):
+    self.__directory=directory
+    self.__operations=[]
+    self.__temporaryFiles=[]
+  def __bool__(self):
+    return bool(self.__operations)
+  # Server side copy of src (at the given revision) to dst
+  def copy(self, src: str, dst: str, *, revision: str|int="HEAD"):
+    self.__operations.append(('cp', str(revision), src, dst))
+  def mkdir(self, url: str):
+    self.__operations.append(('mkdir', url))
+  # Uploads the local file path to url
+  def put(self, path: str, url: str):
+    self.__operations.append(('put', path, url))
+  # Creates url as a symbolic link to target (svn stores it as a file with svn:special set)
+  def link(self, target: str, url: str):
+    self.__operations.append(('put', self.__temporaryFile(f"link {target}"), url))
+    self.propset('svn:special', '*', url)
+  def propset(self, name: str, value: str, url: str):
+    self.__operations.append(('propset', name, value, url))
+  # Sets the svn:externals of url to the entries of values (a DirWithExternals)
+  def setExternals(self, url: str, values):
+    self.__operations.append(('propsetf', 'svn:externals', self.__temporaryFile(externalsValue(values)), url))
+  # Commits all the operations added so far
+  def commit(self, *, message: str):
+    try:
+      # Arguments are passed through a file (one per line) as they may be too many for a command line
+      arguments=self.__temporaryFile("".join(f"{arg}\n" for operation in self.__operations for arg in operation))
+      executeSvnmucc('-m', message, '-X', arguments)
+    finally:
+      for path in self.__temporaryFiles:
+        os.remove(path)
+      self.__temporaryFiles=[]
+      self.__operations=[]
+  def __temporaryFile(self, content: str):
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".txt", dir=self.__directory, delete=False) as f:
+      f.write(content)
+    self.__temporaryFiles.append(f.name)
+    return f.name
+
 def dateTimeFromString(s):
   return datetime.datetime.strptime(s, "%Y-%m-%dT%H:%M:%S.%fZ")
 